@@ -1,13 +1,21 @@
+import asyncio
 import docker
-import uuid
+import gzip
+import orjson
+import redis
+import secrets
 import os
+import time
 import logging
-from flask import Flask, request, redirect, url_for, jsonify, render_template_string
+import threading
+from celery import Celery
+from celery.signals import worker_process_init
+from quart import Quart, request, redirect, url_for, send_from_directory
 
 # --- Basic Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = Flask(__name__)
+app = Quart(__name__)
 
 # --- Configuration ---
 # The base URL where the application is accessible externally.
@@ -18,6 +26,9 @@ logging.info(f"Using REVERSE_PROXY_BASE_URL: {REVERSE_PROXY_BASE_URL}")
 if REVERSE_PROXY_BASE_URL == 'http://localhost':
     logging.warning("REVERSE_PROXY_BASE_URL is set to default 'http://localhost'. "
                     "This is likely incorrect for Codespaces. Ensure it's set via environment variable.")
+# Normalized once at import; per-session URLs are built from this at launch
+# time, so nothing re-strips the trailing slash per render.
+REVERSE_PROXY_BASE_URL_NORMALIZED = REVERSE_PROXY_BASE_URL.rstrip('/')
 
 FIREFOX_IMAGE = "jlesage/firefox:latest"
 # Internal port where noVNC runs inside the jlesage/firefox container (web UI port)
@@ -29,145 +40,230 @@ DOCKER_NETWORK = "proxy_network"
 
 
 # --- Initialize Docker Client ---
-try:
+# docker.from_env() negotiates the API version with the daemon, i.e. it is a
+# network round-trip that fails outright while the daemon is down. So the
+# client is built inside the background ping loop, with retry: process start
+# never waits on the daemon, and a daemon that boots after the controller is
+# picked up on a later iteration. Handlers consult _docker_ok instead of
+# pinging inline.
+client = None
+_docker_ok = False
+
+
+def _make_docker_client():
     # In Codespaces, docker.from_env() should connect to the Docker daemon available to the Codespace.
-    client = docker.from_env()
-    client.ping() # Check connection
-    logging.info("Successfully connected to Docker daemon.")
-except Exception as e:
-    logging.error(f"Fatal Error: Could not connect to Docker daemon: {e}")
-    # In a real app, you might prevent Flask from starting or show a persistent error page.
-    client = None
-
-# Simple in-memory store for active sessions (Replace with DB/Redis in production)
-# Format: { session_id: {'container_id': '...', 'container_name': '...'} }
-active_sessions = {}
-
-# --- HTML Template for Simple UI ---
-HOME_PAGE_HTML = """
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Launch Firefox Session (Codespace)</title>
-    <style>
-        body { font-family: sans-serif; line-height: 1.6; padding: 20px; }
-        h1, h2 { border-bottom: 1px solid #ccc; padding-bottom: 5px; }
-        ul { list-style: none; padding-left: 0; }
-        li { margin-bottom: 10px; padding: 10px; border: 1px solid #eee; border-radius: 4px; }
-        button, a { padding: 8px 15px; text-decoration: none; border-radius: 4px; cursor: pointer; }
-        button { background-color: #007bff; color: white; border: none; }
-        a { display: inline-block; margin-left: 10px; }
-        a.open { background-color: #28a745; color: white; }
-        a.stop { background-color: #dc3545; color: white; }
-        .error { color: red; font-weight: bold; }
-        .warning { color: orange; }
-    </style>
-</head>
-<body>
-    <h1>Launch a Temporary Firefox Session (in GitHub Codespace)</h1>
-
-    {% if docker_error %}
-        <p class="error">FATAL ERROR: Cannot connect to Docker Daemon. The application cannot function.</p>
-    {% else %}
-        {% if base_url_warning %}
-            <p class="warning">Warning: The application's base URL might be misconfigured. Links may not work correctly. Ensure REVERSE_PROXY_BASE_URL is set.</p>
-        {% endif %}
-        <form action="{{ url_for('launch_firefox') }}" method="post">
-            <button type="submit">Launch New Session</button>
-        </form>
-    {% endif %}
-
-    <h2>Active Sessions:</h2>
-    <ul>
-    {% for session_id, data in sessions.items() %}
-        <li>
-            Session <strong>{{ session_id }}</strong>
-            (Container: {{ data.container_name }})
-            <a class="open" href="{{ proxy_base_url }}session/{{ session_id }}/" target="_blank" title="Opens the Firefox session in a new tab">Open</a>
-            <a class="stop" href="{{ url_for('stop_firefox', session_id=session_id) }}" title="Stops and removes the container for this session">Stop</a>
-        </li>
-    {% else %}
-        <li>No active sessions.</li>
-    {% endfor %}
-    </ul>
-
-    <h2>Logs / Status:</h2>
-    <pre style="background-color: #f0f0f0; border: 1px solid #ccc; padding: 10px; max-height: 200px; overflow-y: auto;">{{ status_log | default('No status updates yet.') }}</pre>
-
-</body>
-</html>
-"""
-
-# Store simple status messages
-status_log_messages = []
+    # max_pool_size keeps 64 connections to the daemon alive instead of the
+    # default 10, so parallel launch/stop calls reuse sockets rather than
+    # re-handshaking under load.
+    return docker.from_env(max_pool_size=64)
+
+
+def _ping_loop():
+    global client, _docker_ok
+    while True:
+        try:
+            if client is None:
+                client = _make_docker_client()
+            client.ping()
+            if not _docker_ok:
+                logging.info("Successfully connected to Docker daemon.")
+            _docker_ok = True
+        except Exception as e:
+            if _docker_ok or client is None:
+                logging.error(f"Docker daemon not reachable: {e}")
+            _docker_ok = False
+        time.sleep(5)
+
+
+threading.Thread(target=_ping_loop, daemon=True).start()
+
+# --- Session Store (Redis) ---
+# Sessions live in Redis so they survive restarts and are shared across
+# WSGI workers. Layout:
+#   "sessions"              -> set of active session ids
+#   "session:<session_id>"  -> hash {'container_id': '...', 'container_name': '...'}
+REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
+# Sessions expire server-side after this many seconds; the expiry listener
+# below stops the matching container, so no Python-side reaper loop is needed.
+MAX_SESSION_SECONDS = int(os.getenv('MAX_SESSION_SECONDS', '3600'))
+# One pool for the whole process; individual commands borrow connections from it.
+redis_pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT,
+                                  decode_responses=True, max_connections=50)
+r = redis.Redis(connection_pool=redis_pool)
+
+
+# --- Celery (background launches) ---
+# Container launches run in a Celery worker so the HTTP request returns
+# immediately instead of blocking on the image start time.
+celery_app = Celery('controller',
+                    broker=f"redis://{REDIS_HOST}:{REDIS_PORT}/1",
+                    backend=f"redis://{REDIS_HOST}:{REDIS_PORT}/2")
+
+
+@worker_process_init.connect
+def _init_worker_docker_client(**_kwargs):
+    # Each forked Celery worker process gets its own Docker client; a socket
+    # inherited across fork must not be shared between processes.
+    global client
+    client = _make_docker_client()
+
+
+def get_active_sessions():
+    """Fetch all active sessions from Redis in a single round-trip (pipelined)."""
+    session_ids = sorted(r.smembers("sessions"))
+    pipe = r.pipeline()
+    for session_id in session_ids:
+        pipe.hgetall(f"session:{session_id}")
+    results = pipe.execute()
+    # Drop ids whose hash has already disappeared (e.g. expired between calls)
+    return {sid: data for sid, data in zip(session_ids, results) if data}
+
+
+# Liveness check cache: one containers.list round-trip covers every session,
+# instead of an inspect RPC per session, and rapid dashboard polls share the
+# result for a second.
+#
+# Thread-safety note: session state itself lives in Redis, where every
+# command is atomic server-side, so no in-process locking is needed for it.
+# This cache is the one piece of shared mutable state left in the process;
+# its check-and-refresh is guarded by a lock so it stays correct if handlers
+# ever run on multiple threads (e.g. free-threaded CPython).
+_SYNC_CACHE_TTL = 1.0
+_sync_cache = {'expires': 0.0, 'containers': {}}
+_sync_cache_lock = threading.Lock()
+
+
+def _sync_sessions():
+    """Map session_id -> Container for all firefox-session-* containers."""
+    with _sync_cache_lock:
+        now = time.monotonic()
+        if now >= _sync_cache['expires']:
+            containers = client.containers.list(all=True, filters={'name': 'firefox-session-'})
+            _sync_cache['containers'] = {c.name.split('-')[-1]: c for c in containers}
+            _sync_cache['expires'] = now + _SYNC_CACHE_TTL
+        return _sync_cache['containers']
+
+# Status log, kept in Redis so messages from the web process and the Celery
+# workers land in the same dashboard log (the launch task runs in a separate
+# process, so a local deque there would never be seen by /api/sessions).
+# LPUSH+LTRIM keeps it bounded server-side; entries are (epoch-ms, message)
+# pairs and formatting happens at render time, over at most the 10 entries
+# that survive.
+STATUS_LOG_KEY = "status_log"
+STATUS_LOG_MAX = 10
+_START_MS = time.time_ns() // 1_000_000
 def add_status(message):
     logging.info(message)
-    status_log_messages.insert(0, f"[{os.times().elapsed:.2f}s] {message}")
-    # Keep log short for demo purposes
-    while len(status_log_messages) > 10:
-        status_log_messages.pop()
+    entry = orjson.dumps((time.time_ns() // 1_000_000, message)).decode()
+    try:
+        pipe = r.pipeline()
+        pipe.lpush(STATUS_LOG_KEY, entry)
+        pipe.ltrim(STATUS_LOG_KEY, 0, STATUS_LOG_MAX - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        # The log is best-effort; never fail the operation over a log write.
+        logging.warning(f"Could not record status message in Redis: {e}")
 
-@app.route('/')
-def home():
-    base_url_warning = (REVERSE_PROXY_BASE_URL == 'http://localhost')
-    return render_template_string(HOME_PAGE_HTML,
-                                  sessions=active_sessions,
-                                  proxy_base_url=REVERSE_PROXY_BASE_URL,
-                                  docker_error=(client is None),
-                                  base_url_warning=base_url_warning,
-                                  status_log="\n".join(status_log_messages))
+# Traefik label template (adjust rules/service names as needed), defined once
+# at module scope so each launch only fills in the placeholders: {cn} is the
+# container name, {sid} the session id.
+# Assumes Traefik entrypoint is 'web' and network is DOCKER_NETWORK
+TRAEFIK_LABEL_TEMPLATE = (
+    ("traefik.enable", "true"),
+    # Route based on path prefix
+    ("traefik.http.routers.{cn}.rule", "PathPrefix(`/session/{sid}`)"),
+    # Assign to the 'web' entrypoint (defined in docker-compose for Traefik)
+    ("traefik.http.routers.{cn}.entrypoints", "web"),
+    # Define the service that points to the container
+    ("traefik.http.services.{cn}.loadbalancer.server.port", FIREFOX_INTERNAL_PORT),
+    # Strip the prefix since jlesage/firefox serves from root
+    ("traefik.http.routers.{cn}.middlewares", "strip-session-{sid}"),
+    ("traefik.http.middlewares.strip-session-{sid}.stripprefix.prefixes", "/session/{sid}"),
+)
 
-@app.route('/launch', methods=['POST'])
-def launch_firefox():
-    if not client:
-        add_status("ERROR: Docker client not available.")
-        return redirect(url_for('home'))
 
-    session_id = str(uuid.uuid4())[:8] # Short unique ID
-    container_name = f"firefox-session-{session_id}"
+# The labels are fixed-shape, so serialize the template to JSON once at
+# import; each launch then stamps in the two placeholders with str.replace
+# and parses the result - cheaper than re-formatting six keys and values
+# into a fresh dict every call.
+TRAEFIK_LABELS_JSON_TMPL = orjson.dumps(
+    {key.format(cn='__CN__', sid='__SID__'): value.format(cn='__CN__', sid='__SID__')
+     for key, value in TRAEFIK_LABEL_TEMPLATE}).decode()
+
+
+def build_traefik_labels(container_name, session_id):
+    labels_json = (TRAEFIK_LABELS_JSON_TMPL
+                   .replace('__CN__', container_name)
+                   .replace('__SID__', session_id))
+    return orjson.loads(labels_json)
 
-    # Define labels for Traefik (adjust rules/service names as needed)
-    # Assumes Traefik entrypoint is 'web' and network is DOCKER_NETWORK
-    labels = {
-        "traefik.enable": "true",
-        # Route based on path prefix
-        f"traefik.http.routers.{container_name}.rule": f"PathPrefix(`/session/{session_id}`)",
-        # Assign to the 'web' entrypoint (defined in docker-compose for Traefik)
-        f"traefik.http.routers.{container_name}.entrypoints": "web",
-        # Define the service that points to the container
-        f"traefik.http.services.{container_name}.loadbalancer.server.port": FIREFOX_INTERNAL_PORT,
-        # Optional middleware: Strip the prefix if the app inside doesn't expect it
-        # (jlesage/firefox serves from root, so stripping is needed)
-        f"traefik.http.routers.{container_name}.middlewares": f"strip-session-{session_id}",
-        f"traefik.http.middlewares.strip-session-{session_id}.stripprefix.prefixes": f"/session/{session_id}",
-    }
 
+@celery_app.task
+def launch_container(session_id, container_name, labels):
+    """Run the Firefox container for a reserved PENDING session (Celery worker)."""
     add_status(f"Attempting to launch container '{container_name}' for session {session_id}")
-    try:
-        container = client.containers.run(
-            image=FIREFOX_IMAGE,
-            detach=True,          # Run in background
-            auto_remove=True,     # Remove container when stopped (simplifies demo cleanup)
-            name=container_name,
-            labels=labels,
-            network=DOCKER_NETWORK, # Connect to the same network as Traefik
+    create_kwargs = dict(
+        image=FIREFOX_IMAGE,
+        name=container_name,
+        labels=labels,
+        host_config=client.api.create_host_config(
+            auto_remove=True,        # Remove container when stopped (simplifies demo cleanup)
+            network_mode=DOCKER_NETWORK, # Connect to the same network as Traefik
             # Add resource limits in production! e.g.,
             # mem_limit="768m", # Be mindful of Codespace limits!
             # cpu_shares=512,   # Relative CPU weight
-            environment={
-                 # Example: Set timezone or other vars supported by the image
-                 'TZ': 'America/Toronto' # Example timezone from context
-            }
-        )
-        active_sessions[session_id] = {'container_id': container.id, 'container_name': container_name}
-        add_status(f"Launched container {container.short_id} ('{container_name}') for session {session_id}")
+        ),
+        environment={
+             # Example: Set timezone or other vars supported by the image
+             'TZ': 'America/Toronto' # Example timezone from context
+        }
+    )
+    try:
+        # Low-level create + start: two RPCs total. The high-level
+        # containers.run does create + an inspect (to build the Container
+        # model) + start, i.e. one round-trip more per launch.
+        try:
+            response = client.api.create_container(**create_kwargs)
+        except docker.errors.ImageNotFound:
+            # containers.run pulled missing images on demand; the low-level
+            # create does not, so keep that fallback for fresh hosts.
+            add_status(f"Image '{FIREFOX_IMAGE}' not present locally; pulling (this can take a while)")
+            client.api.pull(FIREFOX_IMAGE)
+            response = client.api.create_container(**create_kwargs)
+        container_id = response['Id']
+        client.api.start(container_id)
+        # /stop or TTL expiry may have removed the reservation while the
+        # container was starting; an unconditional hset would then recreate
+        # the session hash as an orphan (no TTL, not in the "sessions" set)
+        # backing a container nobody can see or stop. Record the container
+        # only if the reservation survived, and re-check after the write to
+        # close the gap between the check and the hset.
+        reserved = r.sismember("sessions", session_id)
+        if reserved:
+            r.hset(f"session:{session_id}",
+                   mapping={'container_id': container_id, 'status': 'RUNNING'})
+            if not r.sismember("sessions", session_id):
+                r.delete(f"session:{session_id}")
+                reserved = False
+        if not reserved:
+            add_status(f"Session {session_id} was stopped before launch finished; stopping container '{container_name}'")
+            try:
+                client.api.stop(container_id, timeout=5)
+            except docker.errors.NotFound:
+                pass # auto_remove already cleaned it up
+            return
+        add_status(f"Launched container {container_id[:12]} ('{container_name}') for session {session_id}")
 
     except docker.errors.APIError as e:
         add_status(f"ERROR launching container: {e}")
+        # The launch failed: drop the PENDING reservation so the dashboard
+        # doesn't show a dead session.
+        r.srem("sessions", session_id)
+        r.delete(f"session:{session_id}")
         # Attempt to clean up if container exists but failed mid-start
         try:
-            existing_container = client.containers.get(container_name)
-            existing_container.remove(force=True)
+            client.api.remove_container(container_name, force=True)
             add_status(f"Cleaned up potentially failed container '{container_name}'")
         except docker.errors.NotFound:
             pass # Container didn't get created far enough to need removal
@@ -176,46 +272,199 @@ def launch_firefox():
 
     except Exception as e:
         add_status(f"ERROR: Unexpected error launching container: {e}")
+        r.srem("sessions", session_id)
+        r.delete(f"session:{session_id}")
+
+
+# Gzip text responses above this size. The dashboard shell and the JSON the
+# browser polls every 2s are both highly compressible, so this cuts most of
+# the controller's egress. (flask-compress has no Quart equivalent, hence the
+# small hook here.)
+COMPRESS_MIN_SIZE = 256
+_COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript')
+
+
+@app.after_request
+async def _compress_response(response):
+    if ('gzip' not in request.headers.get('Accept-Encoding', '').lower()
+            or not (200 <= response.status_code < 300)
+            or 'Content-Encoding' in response.headers
+            or not (response.content_type or '').startswith(_COMPRESSIBLE_TYPES)):
+        return response
+    data = await response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, 6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers.add('Vary', 'Accept-Encoding')
+    return response
+
+
+@app.route('/')
+async def home():
+    # Static shell; the browser renders it from /api/sessions. Marked
+    # cacheable so repeat visits and polls never refetch the HTML.
+    response = await send_from_directory(app.static_folder, 'index.html')
+    response.headers['Cache-Control'] = 'public, max-age=300, immutable'
+    return response
+
+@app.route('/api/sessions')
+async def api_sessions():
+    # The Redis and Docker clients are synchronous; run them on worker
+    # threads so a slow daemon or server doesn't stall the event loop and
+    # every other in-flight request with it.
+    def fetch_state():
+        return get_active_sessions(), r.lrange(STATUS_LOG_KEY, 0, STATUS_LOG_MAX - 1)
+
+    sessions, raw_log = await asyncio.to_thread(fetch_state)
+    if _docker_ok:
+        # Flag sessions whose container has vanished (crash, auto_remove, ...)
+        live = await asyncio.to_thread(_sync_sessions)
+        for session_id, data in sessions.items():
+            if data.get('status') == 'RUNNING' and session_id not in live:
+                data['status'] = 'GONE'
+    payload = {
+        'sessions': sessions,
+        'status_log': [f"[{(ts_ms - _START_MS) / 1000:.2f}s] {m}"
+                       for ts_ms, m in map(orjson.loads, raw_log)],
+        'base_url': REVERSE_PROXY_BASE_URL,
+        'docker_error': not _docker_ok,
+        'base_url_warning': REVERSE_PROXY_BASE_URL == 'http://localhost',
+    }
+    # orjson is several times faster than stdlib json for dict payloads
+    return app.response_class(orjson.dumps(payload), mimetype='application/json')
+
+@app.route('/launch', methods=['POST'])
+async def launch_firefox():
+    if not _docker_ok:
+        await asyncio.to_thread(add_status, "ERROR: Docker daemon not reachable.")
+        return redirect(url_for('home'))
+
+    session_id = secrets.token_hex(4) # Short unique ID (8 hex chars)
+    container_name = f"firefox-session-{session_id}"
+    labels = build_traefik_labels(container_name, session_id)
+
+    # Reserve the session as PENDING and hand the slow containers.run call to
+    # a Celery worker; the browser gets its redirect immediately.
+    def reserve_and_queue():
+        # The open URL is immutable for the session's lifetime; compute it
+        # once here instead of assembling it on every dashboard render.
+        r.hset(f"session:{session_id}",
+               mapping={'container_name': container_name, 'status': 'PENDING',
+                        'open_url': f"{REVERSE_PROXY_BASE_URL_NORMALIZED}/session/{session_id}/"})
+        r.sadd("sessions", session_id)
+        # Let Redis expire the session record; stale entries from crashed or
+        # auto-removed containers clean themselves up.
+        r.expire(f"session:{session_id}", MAX_SESSION_SECONDS)
+        launch_container.delay(session_id, container_name, labels)
+        add_status(f"Queued launch of container '{container_name}' for session {session_id}")
+
+    # Redis writes and the broker publish are blocking; keep them off the
+    # event loop.
+    await asyncio.to_thread(reserve_and_queue)
 
     # Redirect back home to see the updated list and status
     return redirect(url_for('home'))
 
 @app.route('/stop/<session_id>')
-def stop_firefox(session_id):
-    if not client:
-        add_status("ERROR: Docker client not available.")
+async def stop_firefox(session_id):
+    if not _docker_ok:
+        await asyncio.to_thread(add_status, "ERROR: Docker daemon not reachable.")
         return redirect(url_for('home'))
 
-    session_info = active_sessions.pop(session_id, None)
+    # Fetch-and-delete in one round-trip: hgetall tells us whether the session
+    # existed, srem/delete remove it regardless.
+    def pop_session():
+        pipe = r.pipeline()
+        pipe.hgetall(f"session:{session_id}")
+        pipe.srem("sessions", session_id)
+        pipe.delete(f"session:{session_id}")
+        return pipe.execute()[0]
+
+    session_info = await asyncio.to_thread(pop_session)
     if session_info:
-        container_id = session_info['container_id']
+        # A PENDING session has no container id yet; fall back to the name.
+        container_id = session_info.get('container_id') or session_info['container_name']
         container_name = session_info['container_name']
-        add_status(f"Attempting to stop container {container_id} ('{container_name}') for session {session_id}")
+        await asyncio.to_thread(
+            add_status, f"Attempting to stop container {container_id} ('{container_name}') for session {session_id}")
         try:
-            container = client.containers.get(container_id)
-            # Stop with a short timeout. auto_remove=True should handle deletion.
-            container.stop(timeout=5)
-            add_status(f"Stopped container '{container_name}'")
+            # Stop with a short timeout via the low-level API: a single POST,
+            # instead of an inspect GET (containers.get) followed by the stop.
+            # auto_remove=True should handle deletion. This call can block for
+            # the full timeout, so it runs on a worker thread, not the loop.
+            await asyncio.to_thread(client.api.stop, container_id, timeout=5)
+            await asyncio.to_thread(add_status, f"Stopped container '{container_name}'")
             # NOTE: If auto_remove=False was used, you would add: container.remove() here.
         except docker.errors.NotFound:
-            add_status(f"Warning: Container '{container_name}' already removed or not found.")
+            await asyncio.to_thread(
+                add_status, f"Warning: Container '{container_name}' already removed or not found.")
         except docker.errors.APIError as e:
-            add_status(f"ERROR stopping container '{container_name}': {e}")
+            await asyncio.to_thread(add_status, f"ERROR stopping container '{container_name}': {e}")
             # Decide if you should put session_info back into active_sessions if stop fails
         except Exception as e:
-             add_status(f"ERROR: Unexpected error stopping container '{container_name}': {e}")
+            await asyncio.to_thread(
+                add_status, f"ERROR: Unexpected error stopping container '{container_name}': {e}")
     else:
-        add_status(f"Warning: Session ID {session_id} not found. Cannot stop.")
+        await asyncio.to_thread(add_status, f"Warning: Session ID {session_id} not found. Cannot stop.")
 
     return redirect(url_for('home'))
 
+def _session_expiry_listener():
+    """Stop the container of any session whose Redis key hit its TTL.
+
+    Relies on keyspace notifications ('Ex'), so expiry handling costs nothing
+    until Redis actually expires a key. Every Hypercorn worker runs its own
+    copy of this listener; that is deliberate - srem/delete/stop are all
+    idempotent, so the duplicates only cost a redundant no-op RPC per expiry
+    and save us a single-owner election.
+    """
+    while True:
+        try:
+            r.config_set('notify-keyspace-events', 'Ex')
+            pubsub = r.pubsub()
+            pubsub.psubscribe('__keyevent@*__:expired')
+            for message in pubsub.listen():
+                if message.get('type') != 'pmessage':
+                    continue
+                key = message.get('data', '')
+                if not isinstance(key, str) or not key.startswith('session:'):
+                    continue
+                session_id = key.split(':', 1)[1]
+                r.srem("sessions", session_id)
+                # Also drop any hash a concurrently-finishing launch may have
+                # recreated after the expiry fired.
+                r.delete(key)
+                add_status(f"Session {session_id} expired after {MAX_SESSION_SECONDS}s; stopping its container")
+                if not _docker_ok:
+                    continue
+                try:
+                    client.api.stop(f"firefox-session-{session_id}", timeout=5)
+                except docker.errors.NotFound:
+                    pass # Container already gone (auto_remove, crash, manual stop)
+                except Exception as e:
+                    logging.error(f"Failed to stop expired session {session_id}: {e}")
+        except Exception as e:
+            # A transient Redis hiccup must not end TTL cleanup for the life
+            # of the process; back off and resubscribe.
+            logging.error(f"Session expiry listener error: {e}; retrying in 5s")
+            time.sleep(5)
+
+
+@app.before_serving
+async def _start_expiry_listener():
+    threading.Thread(target=_session_expiry_listener, daemon=True).start()
+
+
 if __name__ == '__main__':
-    # Make sure Flask listens on 0.0.0.0 to be accessible within the Docker network
-    # Use Waitress or Gunicorn in production instead of Flask's dev server
-    # Use debug=False in production
-    if client is None:
-        print("\n *** Cannot start Flask server: Docker client unavailable. ***\n")
+    # The built-in dev server is single-process and for local debugging only.
+    # Production runs under Hypercorn (see Dockerfile):
+    #   hypercorn app:app -b 0.0.0.0:5000 -w 2
+    if not os.getenv('QUART_DEV'):
+        print("\n *** Set QUART_DEV=1 to run the dev server locally; "
+              "production uses Hypercorn (see Dockerfile). ***\n")
     else:
-        print(f"\nStarting Flask controller. Access via reverse proxy URL: {REVERSE_PROXY_BASE_URL}/\n")
-        # Use port 5000 internally as configured in docker-compose.yml
-        app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+        print(f"\nStarting controller. Access via reverse proxy URL: {REVERSE_PROXY_BASE_URL}/\n")
+        # Make sure the app listens on 0.0.0.0 to be accessible within the
+        # Docker network; port 5000 matches docker-compose.yml.
+        app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file